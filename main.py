@@ -14,6 +14,10 @@ import asyncio
 import gzip
 import pickle
 import socket
+import time
+import math
+from collections import deque
+from contextlib import asynccontextmanager
 import aiohttp
 from urllib.parse import urljoin, urlparse
 import pytz
@@ -270,11 +274,16 @@ class ConfigManager:
                         # 类型转换
                         if name.startswith('open_'):
                             return value.lower() in ('true', 'yes', '1', 'on')
-                        elif name in ['app_port', 'urls_limit']:
+                        elif name in ['app_port', 'urls_limit', 'speed_test_limit']:
                             try:
                                 return int(value)
                             except:
                                 return getattr(DefaultConfig, name.upper())
+                        elif name in ['request_timeout', 'speed_test_timeout']:
+                            try:
+                                return float(value)
+                            except:
+                                return getattr(DefaultConfig, name.upper())
                         else:
                             return value
                     # 使用默认值
@@ -302,6 +311,183 @@ def get_config():
     """获取配置"""
     return config_manager.config
 
+# ==================== 自适应并发控制器 ====================
+class AdaptiveController:
+    """
+    探测并发与超时的自适应控制器（AIMD）
+
+    - 每完成一轮探测（数量等于当前并发数）评估一次：
+      超时或连接失败占比过高则并发减半，p95相对稳定基线未明显上升则并发加一
+    - 连续多轮因延迟保持时，基线重新锚定到当前p95，
+      以适应速度不同但稳定的主机
+    - 单个主机的超时由其观测到的p95延迟推算，
+      并发上限为 speed_test_limit，超时上限为 speed_test_timeout
+    """
+    
+    MIN_CONCURRENCY = 1
+    INITIAL_CONCURRENCY = 2
+    MIN_TIMEOUT = 1.0
+    TIMEOUT_FACTOR = 3.0        # 主机超时 = p95延迟 * 系数
+    TIMEOUT_RATE_LIMIT = 0.2    # 一轮内超时及连接失败占比超过该值则退避
+    LATENCY_TOLERANCE = 1.5     # p95超过基线该倍数视为延迟恶化
+    BASELINE_ALPHA = 0.3        # 稳定轮次p95的EWMA平滑系数
+    HOLD_LIMIT = 3              # 连续保持该轮数后基线重新锚定
+    HOST_SAMPLES = 20           # 每个主机保留的延迟样本数
+    
+    def __init__(self, max_concurrency: int, max_timeout: float):
+        self.max_concurrency = max(self.MIN_CONCURRENCY, int(max_concurrency))
+        self.max_timeout = max(self.MIN_TIMEOUT, float(max_timeout))
+        self.concurrency = min(self.INITIAL_CONCURRENCY, self.max_concurrency)
+        self.in_flight = 0
+        # 延迟创建，确保绑定到运行中的事件循环
+        self._condition: Optional[asyncio.Condition] = None
+        # 并发上调后需额外唤醒的等待者数量
+        self._pending_wakeups = 0
+        self._host_latency: Dict[str, deque] = {}
+        self._round_latency: List[float] = []
+        self._round_failures = 0
+        self._last_p95: Optional[float] = None
+        # 由未保持、未退避的稳定轮次平滑更新，连续保持 HOLD_LIMIT 轮后重新锚定
+        self._baseline_p95: Optional[float] = None
+        self._consecutive_holds = 0
+        self.stats = {
+            "probes": 0,
+            "timeouts": 0,
+            "errors": 0,
+            "increases": 0,
+            "decreases": 0,
+            "holds": 0,
+            "at_cap": 0,
+            "rebaselines": 0,
+            "peak_concurrency": self.concurrency
+        }
+    
+    @staticmethod
+    def percentile(values: List[float], pct: float) -> float:
+        """最近秩法计算百分位数"""
+        ordered = sorted(values)
+        index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+        return ordered[index]
+    
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个探测并发名额，超出当前并发上限时等待"""
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.concurrency)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self.in_flight -= 1
+                # 只唤醒空出名额对应的等待者，避免大量等待者同时竞争锁
+                self._condition.notify(1 + self._pending_wakeups)
+                self._pending_wakeups = 0
+    
+    def timeout_for(self, url: str) -> float:
+        """
+        根据主机的p95延迟推算超时
+        
+        Args:
+            url: 待探测的URL
+            
+        Returns:
+            超时时长（秒），该主机无样本时使用上限
+        """
+        samples = self._host_latency.get(urlparse(url).netloc)
+        if not samples:
+            # 各主机速度差异大，首次探测不借用其他主机的延迟
+            return self.max_timeout
+        p95 = self.percentile(list(samples), 95)
+        return min(self.max_timeout, max(self.MIN_TIMEOUT, p95 * self.TIMEOUT_FACTOR))
+    
+    def record(self, url: str, latency: Optional[float], timeout: Optional[float] = None):
+        """
+        记录一次探测结果
+        
+        Args:
+            url: 探测的URL
+            latency: 响应延迟（秒），None表示探测失败
+            timeout: 超时失败时探测实际使用的超时（秒），不传表示连接失败
+        """
+        self.stats["probes"] += 1
+        host = urlparse(url).netloc
+        if latency is None:
+            self._round_failures += 1
+            if timeout is None:
+                # 连接失败只计入本轮失败，不产生延迟样本
+                self.stats["errors"] += 1
+            else:
+                # 超时按实际到期的超时计入样本，使该主机后续超时逐步放宽
+                self.stats["timeouts"] += 1
+                latency = timeout
+        else:
+            self._round_latency.append(latency)
+        if latency is not None:
+            if host not in self._host_latency:
+                self._host_latency[host] = deque(maxlen=self.HOST_SAMPLES)
+            self._host_latency[host].append(latency)
+        
+        if len(self._round_latency) + self._round_failures >= self.concurrency:
+            self._adjust()
+    
+    def _adjust(self):
+        """一轮结束后按AIMD规则调整并发"""
+        total = len(self._round_latency) + self._round_failures
+        failure_rate = self._round_failures / total
+        p95 = self.percentile(self._round_latency, 95) if self._round_latency else None
+        
+        if failure_rate > self.TIMEOUT_RATE_LIMIT:
+            self.concurrency = max(self.MIN_CONCURRENCY, self.concurrency // 2)
+            self.stats["decreases"] += 1
+            action = "减半"
+        elif p95 is not None and self._baseline_p95 and p95 > self._baseline_p95 * self.LATENCY_TOLERANCE:
+            self.stats["holds"] += 1
+            action = "保持"
+            self._consecutive_holds += 1
+            if self._consecutive_holds >= self.HOLD_LIMIT:
+                # 延迟已稳定在新水平，重新锚定基线，后续轮次可继续增长
+                self._baseline_p95 = p95
+                self._consecutive_holds = 0
+                self.stats["rebaselines"] += 1
+        else:
+            self._consecutive_holds = 0
+            if self.concurrency < self.max_concurrency:
+                self.concurrency += 1
+                self._pending_wakeups += 1
+                self.stats["increases"] += 1
+                self.stats["peak_concurrency"] = max(self.stats["peak_concurrency"], self.concurrency)
+                action = "增加"
+            else:
+                self.stats["at_cap"] += 1
+                action = "已达上限"
+            if p95 is not None:
+                if self._baseline_p95 is None:
+                    self._baseline_p95 = p95
+                else:
+                    self._baseline_p95 += self.BASELINE_ALPHA * (p95 - self._baseline_p95)
+        
+        if p95 is not None:
+            self._last_p95 = p95
+        logging.debug(
+            f"并发调整({action}): 并发={self.concurrency}, "
+            f"失败率={failure_rate:.0%}, p95={p95 if p95 is None else f'{p95:.3f}s'}"
+        )
+        self._round_latency = []
+        self._round_failures = 0
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """导出当前控制器决策，用于运行统计"""
+        return {
+            **self.stats,
+            "concurrency": self.concurrency,
+            "p95_latency": self._last_p95,
+            "baseline_p95": self._baseline_p95,
+            "max_timeout": self.max_timeout
+        }
+
 # ==================== 彻底修复的核心类 ====================
 class FixedTVSourceUpdater:
     """修复的TV直播源更新器"""
@@ -320,13 +506,18 @@ class FixedTVSourceUpdater:
             "end_time": datetime.datetime.now(),    # 修复：设置默认值
             "success": False
         }
+        # 测速探测的自适应并发与超时
+        self.probe_controller = AdaptiveController(
+            self.config.speed_test_limit,
+            self.config.speed_test_timeout
+        )
         
     async def initialize(self):
         """初始化异步会话"""
         if self.session is None:
             self.session = aiohttp.ClientSession(
                 headers={'User-Agent': USER_AGENT},
-                timeout=aiohttp.ClientTimeout(total=10)  # 修复：使用固定超时
+                timeout=aiohttp.ClientTimeout(total=self.config.request_timeout)
             )
         
         # 修复：重新设置开始时间
@@ -483,18 +674,23 @@ class FixedTVSourceUpdater:
         
         filtered_sources = {}
         
-        for channel, urls in sources.items():
-            valid_urls = []
-            
-            for url in urls[:self.config.urls_limit]:
-                # 修复：使用更宽松的验证
-                if await self.is_url_acceptable(url):
-                    valid_urls.append(url)
-            
+        async def check_urls(urls: List[str]) -> List[str]:
+            # 修复：使用更宽松的验证
+            urls = urls[:self.config.urls_limit]
+            results = await asyncio.gather(*(self.is_url_acceptable(url) for url in urls))
+            return [url for url, ok in zip(urls, results) if ok]
+        
+        # 并发探测所有频道，实际并发由自适应控制器限制
+        channel_results = await asyncio.gather(*(check_urls(urls) for urls in sources.values()))
+        
+        for channel, valid_urls in zip(sources.keys(), channel_results):
             # 修复：即使没有有效URL，也保留频道（如果配置允许）
             if valid_urls or self.config.open_empty_category:
                 filtered_sources[channel] = valid_urls
         
+        # 仅在实际执行了测速探测时记录控制器决策
+        if self.config.open_speed_test and self.probe_controller.stats["probes"] > 0:
+            self.stats["adaptive"] = self.probe_controller.snapshot()
         logging.info(f"🔍 源过滤完成: {len(filtered_sources)}/{len(sources)} 个频道")
         return filtered_sources
     
@@ -508,12 +704,24 @@ class FixedTVSourceUpdater:
         if not self.config.open_speed_test:
             return True
         
-        # 简单的连接测试（不严格验证）
-        try:
-            async with self.session.head(url, timeout=3) as response:
-                return response.status in [200, 206, 301, 302]
-        except:
-            return True  # 修复：即使连接失败也接受（避免过度过滤）
+        # 简单的连接测试（不严格验证），超时由该主机的观测延迟决定
+        controller = self.probe_controller
+        async with controller.slot():
+            timeout = controller.timeout_for(url)
+            start = time.monotonic()
+            try:
+                async with self.session.head(url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                    controller.record(url, time.monotonic() - start)
+                    return response.status in [200, 206, 301, 302]
+            except asyncio.TimeoutError:
+                controller.record(url, None, timeout)
+                return True  # 修复：即使连接失败也接受（避免过度过滤）
+            except aiohttp.ClientError:
+                # 连接被拒、断开等同样反映链路拥塞，计入本轮失败
+                controller.record(url, None)
+                return True
+            except:
+                return True
     
     def generate_safe_result(self, sources: Dict[str, List[str]]) -> str:
         """生成安全的结果"""
@@ -566,6 +774,20 @@ class FixedTVSourceUpdater:
                 logging.info("   有效率: 0%")
             
             logging.info(f"   耗时: {Utility.format_interval(duration)}")
+            
+            adaptive = self.stats.get("adaptive")
+            if adaptive:
+                p95 = adaptive["p95_latency"]
+                logging.info(
+                    f"   测速并发: 当前 {adaptive['concurrency']} / 峰值 {adaptive['peak_concurrency']} "
+                    f"(增加 {adaptive['increases']} 次, 减半 {adaptive['decreases']} 次, 保持 {adaptive['holds']} 次, "
+                    f"已达上限 {adaptive['at_cap']} 次)"
+                )
+                logging.info(
+                    f"   测速探测: {adaptive['probes']} 次, 超时 {adaptive['timeouts']} 次, 连接失败 {adaptive['errors']} 次, "
+                    f"p95延迟 {'-' if p95 is None else f'{p95:.2f}秒'}, "
+                    f"超时上限 {adaptive['max_timeout']:.1f}秒"
+                )
             logging.info(f"   结果文件: {Paths.FINAL_FILE}")
             
         except Exception as e:
@@ -0,0 +1,217 @@
+"""
+自适应并发与超时控制器测试
+
+使用本地 aiohttp.web 服务作为直播源替身，运行中切换响应延迟
+"""
+
+import asyncio
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+SPEED_TEST_LIMIT = 4
+SPEED_TEST_TIMEOUT = 0.6
+FAST_DELAY = 0.05
+SLOW_DELAY = 0.4
+
+
+def make_config(**overrides):
+    """构造测速相关配置"""
+    values = {
+        "open_speed_test": True,
+        "open_filter_resolution": False,
+        "open_empty_category": True,
+        "urls_limit": 10,
+        "request_timeout": 10,
+        "speed_test_limit": SPEED_TEST_LIMIT,
+        "speed_test_timeout": SPEED_TEST_TIMEOUT,
+    }
+    values.update(overrides)
+    return SimpleNamespace(**values)
+
+
+async def start_stand_in(state):
+    """启动本地替身服务，响应延迟由 state["delay"] 决定"""
+    async def handler(request):
+        await asyncio.sleep(state["delay"])
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_route("*", "/{path:.*}", handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+async def probe(updater, base, count, tag):
+    """并发探测 count 个URL"""
+    urls = [f"{base}/{tag}/{i}.m3u8" for i in range(count)]
+    await asyncio.gather(*(updater.is_url_acceptable(url) for url in urls))
+
+
+@pytest.fixture
+def updater_factory(monkeypatch):
+    # 缩小超时下限，使测试在数秒内完成
+    monkeypatch.setattr(main.AdaptiveController, "MIN_TIMEOUT", 0.1)
+
+    def factory(**overrides):
+        config = make_config(**overrides)
+        monkeypatch.setattr(main, "get_config", lambda: config)
+        return main.FixedTVSourceUpdater()
+    return factory
+
+
+@pytest.mark.asyncio
+async def test_adapts_to_latency_shift(updater_factory):
+    state = {"delay": FAST_DELAY}
+    runner, base = await start_stand_in(state)
+    updater = updater_factory()
+    controller = updater.probe_controller
+    trajectory = []
+    adjust = controller._adjust
+
+    def tracked_adjust():
+        adjust()
+        trajectory.append(controller.concurrency)
+    controller._adjust = tracked_adjust
+    await updater.initialize()
+    try:
+        # 低延迟阶段：并发增长到 speed_test_limit
+        await probe(updater, base, 40, "fast")
+        assert controller.concurrency == SPEED_TEST_LIMIT
+        fast_timeout = controller.timeout_for(base)
+        assert fast_timeout < SLOW_DELAY
+
+        # 延迟突增：超时占比超过20%，并发减半，主机超时放宽到上限
+        state["delay"] = SLOW_DELAY
+        slow_start = len(trajectory)
+        await probe(updater, base, 12, "slow")
+        assert controller.stats["decreases"] >= 1
+        assert controller.stats["timeouts"] >= 1
+        assert min(trajectory[slow_start:]) <= SPEED_TEST_LIMIT // 2
+        assert controller.timeout_for(base) == pytest.approx(SPEED_TEST_TIMEOUT)
+
+        # 恢复：样本刷新后主机超时重新收紧
+        state["delay"] = FAST_DELAY
+        sources = {f"ch{i}": [f"{base}/recover/{i}/{j}.m3u8" for j in range(5)] for i in range(8)}
+        await updater.safe_filter_sources(sources)
+        assert controller.timeout_for(base) < SLOW_DELAY
+
+        adaptive = updater.stats["adaptive"]
+        assert adaptive["probes"] == 40 + 12 + 40
+        assert adaptive["peak_concurrency"] == SPEED_TEST_LIMIT
+        assert adaptive["increases"] >= 2
+        assert adaptive["decreases"] == controller.stats["decreases"]
+        assert adaptive["holds"] >= 1
+        assert adaptive["timeouts"] == controller.stats["timeouts"]
+        assert adaptive["concurrency"] == controller.concurrency
+        assert adaptive["max_timeout"] == SPEED_TEST_TIMEOUT
+    finally:
+        await updater.close()
+        await runner.cleanup()
+
+
+def test_holds_when_latency_creeps_up():
+    controller = main.AdaptiveController(100, 10)
+    latency = 0.1
+    for _ in range(10):
+        for _ in range(controller.concurrency):
+            controller.record("http://a.example/x", latency)
+        # 每轮增长不足1.5倍，仍应相对基线判定为延迟恶化
+        latency *= 1.3
+    assert controller.stats["holds"] > 0
+    assert controller.concurrency < 10
+
+    # 延迟停在新水平后，基线重新锚定，并发恢复增长
+    crept = controller.concurrency
+    for _ in range(10):
+        for _ in range(controller.concurrency):
+            controller.record("http://a.example/x", latency)
+    assert controller.stats["rebaselines"] >= 1
+    assert controller.concurrency > crept
+
+
+def test_grows_again_after_latency_plateau():
+    controller = main.AdaptiveController(10, 10)
+    for _ in range(2):
+        for _ in range(controller.concurrency):
+            controller.record("http://fast.example/x", 0.03)
+    grown = controller.concurrency
+    # 延迟阶跃到新水平后保持平稳，无超时与失败
+    for _ in range(500):
+        controller.record("http://slow.example/x", 0.2)
+    assert controller.stats["holds"] > 0
+    assert controller.stats["rebaselines"] >= 1
+    assert controller.concurrency == 10 > grown
+    assert controller.snapshot()["baseline_p95"] == pytest.approx(0.2)
+
+
+@pytest.mark.asyncio
+async def test_slot_fills_grown_concurrency():
+    controller = main.AdaptiveController(8, 10)
+    peak = {"in_flight": 0, "over": False}
+
+    async def one(i):
+        async with controller.slot():
+            peak["in_flight"] = max(peak["in_flight"], controller.in_flight)
+            peak["over"] |= controller.in_flight > controller.concurrency
+            await asyncio.sleep(0.001)
+            controller.record(f"http://h{i % 5}.example/x", 0.01)
+
+    await asyncio.gather(*(one(i) for i in range(400)))
+    assert controller.concurrency == 8
+    assert peak["in_flight"] == 8
+    assert not peak["over"]
+    assert controller.in_flight == 0
+
+
+def test_rounds_at_cap_are_counted_separately():
+    controller = main.AdaptiveController(2, 10)
+    for _ in range(3):
+        for _ in range(controller.concurrency):
+            controller.record("http://a.example/x", 0.05)
+    stats = controller.snapshot()
+    assert stats["increases"] == 0
+    assert stats["holds"] == 0
+    assert stats["at_cap"] == 3
+
+
+def test_connection_errors_trigger_back_off():
+    controller = main.AdaptiveController(8, 10)
+    controller.concurrency = 8
+    for _ in range(8):
+        controller.record("http://a.example/x", None)
+    assert controller.concurrency == 4
+    assert controller.stats["errors"] == 8
+    assert controller.stats["timeouts"] == 0
+
+
+def test_unknown_host_uses_max_timeout():
+    controller = main.AdaptiveController(4, 10)
+    for _ in range(controller.concurrency):
+        controller.record("http://fast.example/x", 0.01)
+    assert controller.timeout_for("http://fast.example/y") == controller.MIN_TIMEOUT
+    assert controller.timeout_for("http://slow.example/y") == 10
+
+
+def test_expired_timeout_is_recorded_as_sample():
+    controller = main.AdaptiveController(4, 10)
+    controller.record("http://a.example/x", None, 2.0)
+    assert list(controller._host_latency["a.example"]) == [2.0]
+
+
+@pytest.mark.asyncio
+async def test_no_adaptive_stats_without_speed_test(updater_factory):
+    updater = updater_factory(open_speed_test=False, open_filter_resolution=True)
+    await updater.safe_filter_sources({"ch": ["http://127.0.0.1:1/a.m3u8"]})
+    assert "adaptive" not in updater.stats